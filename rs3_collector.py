@@ -1,17 +1,44 @@
+import orjson
 import sqlite3
 import requests
 import time
 from datetime import date
 
+# Module-level SQL constants so sqlite3's statement cache always hits
+_SQL_UPSERT_ITEMS = "INSERT OR REPLACE INTO items VALUES (?,?,?)"
+_SQL_INSERT_HISTORY = "INSERT OR IGNORE INTO history VALUES (?,?,?,?)"
+
+# WITHOUT ROWID stores the row inside the composite-PK B-tree, so each
+# insert maintains one tree instead of a data row plus a separate PK
+# index; STRICT enforces the declared column types.
+_DDL_HISTORY = '''(
+                 item_id INTEGER,
+                 record_date TEXT,
+                 price INTEGER,
+                 volume INTEGER,
+                 PRIMARY KEY (item_id, record_date)) WITHOUT ROWID, STRICT'''
+
 class RS3DataCollector:
     def __init__(self):
         self.db_name = "rs3_market.db"
         self.url = "https://chisel.weirdgloop.org/gazproj/gazbot/rs_dump.json"
         self.headers = {'User-Agent': 'RS3DataCollector/1.0'}
+        # Reuse one connection across requests (keep-alive). Updating the
+        # Session's default headers (rather than passing headers= per
+        # request) keeps Accept-Encoding advertised, so the big JSON dump
+        # arrives gzipped.
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.headers.setdefault('Accept-Encoding', 'gzip, deflate')
 
     def init_db(self):
         """Creates the database tables if they don't exist."""
-        conn = sqlite3.connect(self.db_name)
+        # isolation_level=None: we manage transactions explicitly below.
+        # WAL + synchronous=NORMAL keeps readers unblocked and drops the
+        # commit to one WAL append instead of a full journal fsync.
+        conn = sqlite3.connect(self.db_name, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
         c = conn.cursor()
         
         # Table for Item Definitions (ID, Name, Buy Limit)
@@ -22,14 +49,33 @@ class RS3DataCollector:
 
         # Table for Price History (Link to Item, Date, Price, Volume)
         # Using a composite primary key to prevent duplicate entries for the same day
-        c.execute('''CREATE TABLE IF NOT EXISTS history (
-                     item_id INTEGER,
-                     record_date TEXT,
-                     price INTEGER,
-                     volume INTEGER,
-                     PRIMARY KEY (item_id, record_date))''')
-        
-        conn.commit()
+        c.execute('CREATE TABLE IF NOT EXISTS history ' + _DDL_HISTORY)
+
+        # One-time migration for DBs created when history was a plain
+        # rowid table: rebuild it in the WITHOUT ROWID/STRICT layout
+        schema = c.execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name='history'"
+        ).fetchone()
+        if schema and 'WITHOUT ROWID' not in schema[0]:
+            c.execute("BEGIN IMMEDIATE")
+            c.execute('CREATE TABLE history_new ' + _DDL_HISTORY)
+            c.execute('INSERT INTO history_new SELECT item_id, record_date, price, volume FROM history')
+            c.execute('DROP TABLE history')
+            c.execute('ALTER TABLE history_new RENAME TO history')
+            c.execute("COMMIT")
+
+        # An old backfill index on (item_id, record_date) exactly
+        # duplicates the WITHOUT ROWID primary key; keeping it would
+        # maintain a redundant second B-tree on every insert
+        c.execute('DROP INDEX IF EXISTS idx_history_item_date')
+
+        # Validators from previous downloads, so an unchanged dump can
+        # come back as a body-less 304
+        c.execute('''CREATE TABLE IF NOT EXISTS etag_cache (
+                     url TEXT PRIMARY KEY,
+                     etag TEXT,
+                     last_modified TEXT)''')
+
         return conn
 
     def run_daily_job(self):
@@ -42,10 +88,23 @@ class RS3DataCollector:
             conn = self.init_db()
             c = conn.cursor()
 
-            # 1. Download
-            res = requests.get(self.url, headers=self.headers, timeout=30)
+            # 1. Download (conditionally - skip everything on a 304)
+            cond_headers = {}
+            row = c.execute("SELECT etag, last_modified FROM etag_cache WHERE url = ?",
+                            (self.url,)).fetchone()
+            if row:
+                if row[0]: cond_headers['If-None-Match'] = row[0]
+                if row[1]: cond_headers['If-Modified-Since'] = row[1]
+
+            res = self.session.get(self.url, headers=cond_headers, timeout=30)
+            if res.status_code == 304:
+                with open(log_file, "a") as f:
+                    f.write(f"[{timestamp}] SUCCESS: Dump unchanged (304), nothing to do.\n")
+                print("Unchanged.")
+                return
             res.raise_for_status()
-            data = res.json()
+
+            data = orjson.loads(res.content)
 
             # 2. Process
             items_to_update = []
@@ -59,9 +118,16 @@ class RS3DataCollector:
                 items_to_update.append((int(item_id), item['name'], item.get('limit', 10000)))
                 history_to_insert.append((int(item_id), today_str, int(item['price']), item.get('volume', 0)))
 
-            c.executemany("INSERT OR REPLACE INTO items VALUES (?,?,?)", items_to_update)
-            c.executemany("INSERT OR IGNORE INTO history VALUES (?,?,?,?)", history_to_insert)
-            conn.commit()
+            c.execute("BEGIN IMMEDIATE")
+            c.executemany(_SQL_UPSERT_ITEMS, items_to_update)
+            c.executemany(_SQL_INSERT_HISTORY, history_to_insert)
+            # Validators commit atomically with the data: persisting them
+            # earlier would turn the next run into a 304 no-op even though
+            # today's rows never landed
+            if res.headers.get('ETag') or res.headers.get('Last-Modified'):
+                c.execute("INSERT OR REPLACE INTO etag_cache (url, etag, last_modified) VALUES (?, ?, ?)",
+                          (self.url, res.headers.get('ETag'), res.headers.get('Last-Modified')))
+            c.execute("COMMIT")
             
             # --- SUCCESS LOGGING ---
             with open(log_file, "a") as f: